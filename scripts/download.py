@@ -1,53 +1,86 @@
+import itertools
+import threading
 import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Any, Iterable, Optional, Tuple
+from typing import (
+    Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, TypeVar
+)
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import attrs
 import click
 import requests
 from click import secho
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from . import ghlib
 from .ghlib import Issue, IssueSet, Record, Repo
 
 DEFAULT_TIMEOUT = (3.1, 11.9)
+# Number of issue detail requests allowed in flight at once.
+MAX_CONCURRENT_REQUESTS = 16
+# Number of data files updated at once by the update command.
+MAX_CONCURRENT_UPDATES = 4
+# Keep-alive connections kept per host. This must be large enough for every request
+# that can be in flight or urllib3 will throw away connections (and redo the TLS
+# handshake) under load.
+CONNECTION_POOL_SIZE = MAX_CONCURRENT_REQUESTS * MAX_CONCURRENT_UPDATES
 GITHUB_API = "https://api.github.com"
 GITHUB_GRAPHQL_API = "https://api.github.com/graphql"
 
+# The most recent close event, like the REST API's closed_by (issues can be reopened
+# and closed again).
+CLOSER_FRAGMENTS = """\
+fragment issueCloser on Issue {
+  timelineItems(itemTypes: CLOSED_EVENT, last: 1) {
+    nodes {
+      ... on ClosedEvent {
+        actor {
+          login
+        }
+      }
+    }
+  }
+}
+
+fragment pullRequestCloser on PullRequest {
+  timelineItems(itemTypes: CLOSED_EVENT, last: 1) {
+    nodes {
+      ... on ClosedEvent {
+        actor {
+          login
+        }
+      }
+    }
+  }
+}
+"""
+
+# Issues and pull requests are listed with the same query, $pulls picks which.
 ISSUES_QUERY = """\
-query GraphQLQuery {
-  repository(name: "black", owner: "psf") {
-    kind(orderBy: {field: CREATED_AT, direction: ASC}, first: 100, after: null) {
-      totalCount
+query GraphQLQuery($owner: String!, $name: String!, $cursor: String, $pulls: Boolean!) {
+  repository(name: $name, owner: $owner) {
+    issues(orderBy: {field: CREATED_AT, direction: ASC}, first: 100, after: $cursor) @skip(if: $pulls) {
       pageInfo {
         endCursor
         hasNextPage
       }
-      edges {
-        node {
-          number
-          title
-          labels(first: 15) {
-            nodes {
-              name
-            }
-          }
-          author {
-            login
-          }
-          createdAt
-          closedAt
-          timelineItems(itemTypes: CLOSED_EVENT, first: 1) {
-            nodes {
-              ... on ClosedEvent {
-                actor {
-                  login
-                }
-              }
-            }
-          }
-        }
+      nodes {
+        ...issueListing
+      }
+    }
+    pullRequests(orderBy: {field: CREATED_AT, direction: ASC}, first: 100, after: $cursor) @include(if: $pulls) {
+      pageInfo {
+        endCursor
+        hasNextPage
+      }
+      nodes {
+        ...pullRequestListing
       }
     }
   }
@@ -57,70 +90,304 @@ query GraphQLQuery {
     resetAt
   }
 }
+
+fragment issueListing on Issue {
+  number
+  title
+  labels(first: 15) {
+    nodes {
+      name
+    }
+  }
+  author {
+    login
+  }
+  createdAt
+  closedAt
+  ...issueCloser
+}
+
+fragment pullRequestListing on PullRequest {
+  number
+  title
+  labels(first: 15) {
+    nodes {
+      name
+    }
+  }
+  author {
+    login
+  }
+  createdAt
+  closedAt
+  ...pullRequestCloser
+}
+
+""" + CLOSER_FRAGMENTS
+
+RATE_LIMIT_QUERY = """\
+query GraphQLQuery {
+  rateLimit {
+    limit
+    remaining
+    resetAt
+  }
+}
 """
 
+# How many times a rate limited request is retried before giving up.
+MAX_RETRIES = 5
+# Once less than this fraction of the rate limit remains, requests are spaced out so
+# the rest of the budget lasts until the limit resets.
+THROTTLE_THRESHOLD = 0.1
+# Issues requested per GraphQL query when fetching issue details in bulk.
+ISSUE_BATCH_SIZE = 50
+# Styled once, they label every line of the update summary.
+CHANGE_NEW = click.style("NEW", fg="green")
+CHANGE_CLOSED = click.style("CLOSED", fg="red")
+CHANGE_UPDATED = click.style("UPDATED", fg="yellow")
+
 RateLimit = Tuple[int, int, datetime]
+UpdateResult = Tuple[IssueSet, Record, IssueSet, FrozenSet[int], FrozenSet[int], Dict[str, str]]
+T = TypeVar("T")
 
 
-@attrs.define(slots=False)
-class Fetcher:
-    api: str = attrs.field(validator=attrs.validators.in_(("rest", "graphql")))
-    auth: Tuple[str, Optional[str]]
-    debug: bool = False
+def _parse_json(resp: requests.Response) -> Any:
+    # Decoding the raw bytes skips requests' charset detection and the extra str copy.
+    return ghlib.loads(resp.content)
 
-    _rate_limit: Optional[RateLimit] = attrs.field(default=None, init=False)
+
+@attrs.define
+class Fetcher(ABC):
+    username: str
+    # Requests are spread across all of these tokens to multiply the rate limit.
+    tokens: Tuple[str, ...] = attrs.field(default=(), converter=tuple, repr=False)
+    debug: bool = False
+    # URL path -> ETag of the last response seen, used for conditional requests.
+    etags: Dict[str, str] = attrs.field(factory=dict)
+
+    session: requests.Session = attrs.field(init=False, repr=False)
+    # Last known rate limit for each token (None is unauthenticated access).
+    # Keyed by the tokens themselves, so keep it out of the repr like tokens.
+    _rate_limits: Dict[Optional[str], RateLimit] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+    _token_cycle: Iterator[Optional[str]] = attrs.field(init=False, repr=False)
+    _throttle_lock: threading.Lock = attrs.field(factory=threading.Lock, init=False, repr=False)
+    _next_request_at: float = attrs.field(default=0.0, init=False)
+
+    @_token_cycle.default
+    def _default_token_cycle(self) -> Iterator[Optional[str]]:
+        return itertools.cycle(self.tokens or (None,))
 
     def __enter__(self) -> "Fetcher":
         self.session = requests.Session()
-        self.session.headers["User-Agent"] = f"{self.auth[0]} using requests/{requests.__version__}"
-        if self.auth[1] is not None:
-            self.session.auth = self.auth
+        # Everything goes to one host, so one pool sized for our concurrency is enough.
+        # Transient server errors and dropped connections are retried transparently
+        # here, rate limiting is handled by request().
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            # Our POSTs are GraphQL queries, which are safe to repeat.
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+            # Retry-After means rate limiting, which request() handles for all threads.
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=CONNECTION_POOL_SIZE,
+            pool_block=False,
+            max_retries=retry,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        user_agent = f"{self.username} using requests/{requests.__version__}"
+        self.session.headers["User-Agent"] = user_agent
         return self
 
     def __exit__(self, *exc: Any) -> None:
         self.session.close()
 
+    @abstractmethod
     def _extract_rate_limit(self, resp: requests.Response) -> RateLimit:
-        if self.api == "rest":
-            headers = resp.headers
-            limit = int(headers["X-Ratelimit-Limit"])
-            remaining = int(headers["X-Ratelimit-Remaining"])
-            reset = int(headers["X-Ratelimit-Reset"])
-            reset_datetime = datetime.fromtimestamp(reset, tz=timezone.utc)
-        else:
-            rate_data = resp.json()["data"]["rateLimit"]
-            limit = rate_data["limit"]
-            remaining = rate_data["remaining"]
-            reset_datetime = ghlib.convert_iso8601_string(rate_data["resetAt"])
-            assert reset_datetime is not None
+        ...
 
-        return (limit, remaining, reset_datetime)
+    @abstractmethod
+    def _lookup_rate_limit(self) -> None:
+        """Make a (free) request just to learn the current rate limit."""
 
+    @abstractmethod
     def root_url(self) -> str:
-        if self.api == "rest":
-            return GITHUB_API
-        else:
-            return GITHUB_GRAPHQL_API
+        ...
+
+    def _is_exhausted(self, token: Optional[str]) -> bool:
+        rate_limit = self._rate_limits.get(token)
+        if rate_limit is None:
+            return False
+        return rate_limit[1] == 0 and rate_limit[2] > datetime.now(timezone.utc)
+
+    def _next_token(self) -> Optional[str]:
+        """Pick the token to use for the next request (round-robin, skipping exhausted ones)."""
+        with self._throttle_lock:
+            for _ in range(len(self.tokens) or 1):
+                token = next(self._token_cycle)
+                if not self._is_exhausted(token):
+                    break
+        return token
+
+    def _request_interval(self) -> float:
+        tokens = self.tokens or (None,)
+        if any(t not in self._rate_limits for t in tokens):
+            # At least one token hasn't been used yet, so there's plenty of budget.
+            return 0.0
+        usable = [self._rate_limits[t] for t in tokens if not self._is_exhausted(t)]
+        if not usable:
+            # Every request will be rejected, request() will wait for the limit to reset.
+            return 0.0
+
+        limit = sum(r[0] for r in usable)
+        remaining = sum(r[1] for r in usable)
+        reset = max(r[2] for r in usable)
+        if remaining >= limit * THROTTLE_THRESHOLD:
+            return 0.0
+        until_reset = (reset - datetime.now(timezone.utc)).total_seconds()
+        return max(until_reset, 0.0) / max(remaining, 1)
+
+    def _throttle(self, delay: float = 0.0) -> None:
+        """Wait until this thread is allowed to make a request.
+
+        If delay is given, all requests (across all threads) are held off for that long.
+        """
+        with self._throttle_lock:
+            now = time.monotonic()
+            if delay:
+                self._next_request_at = max(self._next_request_at, now + delay)
+                return
+            wait = self._next_request_at - now
+            self._next_request_at = max(self._next_request_at, now) + self._request_interval()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _retry_delay(
+        self, resp: requests.Response, attempt: int, token: Optional[str]
+    ) -> Optional[float]:
+        if resp.status_code not in (403, 429):
+            return None
+
+        if "Retry-After" in resp.headers:
+            return float(resp.headers["Retry-After"])
+        if resp.headers.get("X-Ratelimit-Remaining") == "0":
+            reset = int(resp.headers["X-Ratelimit-Reset"])
+            limit = int(resp.headers["X-Ratelimit-Limit"])
+            with self._throttle_lock:
+                self._rate_limits[token] = (
+                    limit, 0, datetime.fromtimestamp(reset, tz=timezone.utc)
+                )
+            if not all(self._is_exhausted(t) for t in self.tokens or (None,)):
+                # Another token still has budget left, switch to it right away.
+                return 0.0
+            return max(reset - time.time(), 0.0) + 1
+        if resp.status_code == 429:
+            return 2.0 ** attempt
+        # A plain 403 is a permissions problem, retrying won't help.
+        return None
 
     def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
         if not (path.startswith("https://") or path.startswith("http://")):
             path = self.root_url() + path
 
-        t0 = time.perf_counter()
-        resp = self.session.request(method, path, timeout=DEFAULT_TIMEOUT, **kwargs)
-        t1 = time.perf_counter()
-        if self.debug:
-            print(path, round(t1 - t0, 3))
-
-        self._rate_limit = self._extract_rate_limit(resp)
+        for attempt in range(MAX_RETRIES + 1):
+            self._throttle()
+            token = self._next_token()
+            auth = (self.username, token) if token is not None else None
+            t0 = time.perf_counter()
+            resp = self.session.request(
+                method, path, auth=auth, timeout=DEFAULT_TIMEOUT, **kwargs
+            )
+            t1 = time.perf_counter()
+            if self.debug:
+                print(path, round(t1 - t0, 3))
+
+            delay = self._retry_delay(resp, attempt, token)
+            if delay is None or attempt == MAX_RETRIES:
+                break
+            if delay:
+                secho(f"\nRate limited by GitHub, retrying in {delay:.0f} seconds.", fg="yellow")
+                self._throttle(delay)
+
+        if resp.ok:
+            rate_limit = self._extract_rate_limit(resp)
+            with self._throttle_lock:
+                self._rate_limits[token] = rate_limit
         resp.raise_for_status()
         return resp
 
-    def get(self, path: str) -> requests.Response:
-        return self.request("GET", path)
+    def get(self, path: str, *, conditional: bool = False) -> requests.Response:
+        """GET path. If conditional, revalidate using the ETag stored for path (if any).
+
+        A conditional request may return 304 Not Modified with an empty body, so
+        only make one if you have a copy of the resource to fall back on.
+        """
+        if conditional and path in self.etags:
+            resp = self.request("GET", path, headers={"If-None-Match": self.etags[path]})
+        else:
+            resp = self.request("GET", path)
+        if conditional and "ETag" in resp.headers:
+            self.etags[path] = resp.headers["ETag"]
+        return resp
+
+    @property
+    def has_rate_limit(self) -> bool:
+        """Whether rate limit information is available without making another request."""
+        return bool(self._rate_limits)
 
     def rate_limit(self) -> RateLimit:
-        return self._rate_limit
+        """Return the rate limit summed across all tokens.
+
+        If no request has been made yet, the rate limit is looked up (for free).
+        """
+        if not self._rate_limits:
+            self._lookup_rate_limit()
+
+        rate_limits = list(self._rate_limits.values())
+        return (
+            sum(r[0] for r in rate_limits),
+            sum(r[1] for r in rate_limits),
+            max(r[2] for r in rate_limits),
+        )
+
+
+@attrs.define
+class RestFetcher(Fetcher):
+    def _extract_rate_limit(self, resp: requests.Response) -> RateLimit:
+        headers = resp.headers
+        limit = int(headers["X-Ratelimit-Limit"])
+        remaining = int(headers["X-Ratelimit-Remaining"])
+        reset = int(headers["X-Ratelimit-Reset"])
+        return (limit, remaining, datetime.fromtimestamp(reset, tz=timezone.utc))
+
+    def _lookup_rate_limit(self) -> None:
+        self.get("/rate_limit")
+
+    def root_url(self) -> str:
+        return GITHUB_API
+
+
+@attrs.define
+class GraphQLFetcher(Fetcher):
+    def _extract_rate_limit(self, resp: requests.Response) -> RateLimit:
+        rate_data = _parse_json(resp)["data"]["rateLimit"]
+        reset_datetime = ghlib.convert_iso8601_string(rate_data["resetAt"])
+        assert reset_datetime is not None
+        return (rate_data["limit"], rate_data["remaining"], reset_datetime)
+
+    def _lookup_rate_limit(self) -> None:
+        self.request("POST", "", json={"query": RATE_LIMIT_QUERY})
+
+    def root_url(self) -> str:
+        return GITHUB_GRAPHQL_API
 
 
 def get_current_datetime() -> datetime:
@@ -133,10 +400,41 @@ def print_rate_limit(rate_limit: RateLimit) -> None:
     print(f" Rate limit resets after {reset_date}.")
 
 
+def _map_concurrently(func: Callable[..., T], jobs: Iterable[Tuple[Any, ...]]) -> Iterator[T]:
+    """Call func(*args) for each job on a thread pool, yielding results as they complete."""
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = [executor.submit(func, *args) for args in jobs]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        except BaseException:
+            # Don't sit around waiting for the rest of the queue if something blew up.
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _page_urls(last_url: str) -> Dict[int, str]:
+    """Return the URLs of pages 2 through N given the URL of the last page (N)."""
+    parts = urlsplit(last_url)
+    query = dict(parse_qsl(parts.query))
+    last_page = int(query["page"])
+    urls = {}
+    for page in range(2, last_page + 1):
+        query["page"] = str(page)
+        urls[page] = urlunsplit(parts._replace(query=urlencode(query)))
+    return urls
+
+
 def enumerate_issues(
-    repo: Repo, fetcher: Fetcher, last_updated: Optional[datetime] = None
+    repo: Repo,
+    fetcher: Fetcher,
+    last_updated: Optional[datetime] = None,
+    *,
+    progress: bool = True,
 ) -> IssueSet:
-    print("Enumerating how many to fetch ...", end="", flush=True)
+    if progress:
+        print("Enumerating how many to fetch ...", end="", flush=True)
     if last_updated is not None:
         stringified = last_updated.replace(microsecond=0).isoformat().replace("+00:00", "Z")
         since = f"&since={stringified}"
@@ -144,96 +442,258 @@ def enumerate_issues(
         since = ""
     url = f"/repos/{repo.owner}/{repo.name}/issues?per_page=100&state=all&direction=asc{since}"
 
-    issues = IssueSet()
-    while True:
-        resp = fetcher.get(url)
-        issues.extend(Issue(**entry) for entry in resp.json())
+    # Without anything new, the URL and its (empty) response are the same as last
+    # time, so a conditional request lets GitHub answer with a free 304.
+    resp = fetcher.get(url, conditional=True)
+    if resp.status_code == 304:
+        if progress:
+            print("\rEnumerating how many to fetch ... 0")
+        return IssueSet()
+
+    issues = IssueSet(Issue.from_api(entry) for entry in _parse_json(resp))
+    if issues:
+        # This data file will be saved with a newer last updated date and this URL
+        # won't be requested again. Keeping its ETag would only risk a stale 304.
+        fetcher.etags.pop(url, None)
+    if progress:
         print(f"\rEnumerating how many to fetch ... {len(issues)}", end="", flush=True)
-        try:
-            url = resp.links["next"]["url"]
-        except KeyError:
-            break
-
-    print()
+    if "last" in resp.links:
+        # The first page tells us how many pages there are, so fetch the rest all at once.
+        def fetch_page(page: int, url: str) -> Tuple[int, List[Issue]]:
+            resp = fetcher.get(url)
+            return page, [Issue.from_api(entry) for entry in _parse_json(resp)]
+
+        pages = {}
+        enumerated = len(issues)
+        page_urls = _page_urls(resp.links["last"]["url"])
+        for page, page_issues in _map_concurrently(fetch_page, page_urls.items()):
+            pages[page] = page_issues
+            enumerated += len(page_issues)
+            if progress:
+                print(f"\rEnumerating how many to fetch ... {enumerated}", end="", flush=True)
+        for page in sorted(pages):
+            issues.extend(pages[page])
+
+    if progress:
+        print()
     return issues
 
 
+def _get_graphql_user(node: Any, key: str) -> str:
+    return node[key]["login"] if node[key] else "ghost"
+
+
+def _parse_graphql_closer(node: Any) -> Optional[str]:
+    events = node["timelineItems"]["nodes"]
+    return _get_graphql_user(events[0], "actor") if events else None
+
+
+def _parse_graphql_issue_node(node: Any, *, is_pr: bool) -> Issue:
+    data = {
+        "number": node["number"],
+        "title": node["title"],
+        "is_pr": is_pr,
+        "created_at": node["createdAt"],
+        "created_by": _get_graphql_user(node, "author"),
+        "closed_at": node["closedAt"],
+        "closed_by": _parse_graphql_closer(node) if node["closedAt"] else None,
+        "labels": tuple(label_node["name"] for label_node in node["labels"]["nodes"]),
+    }
+    return Issue(**data)
+
+
 def _parse_graphql_issues_json(payload: Any, *, is_pr: bool) -> IssueSet:
     issues = IssueSet()
-    payload = payload["edges"]
-    for edge_entry in payload:
-        node = edge_entry["node"]
-        get_user = lambda key, n: n[key]["login"] if n[key] else "ghost"
-        data = {
-            "number": node["number"],
-            "title": node["title"],
-            "is_pr": is_pr,
-            "created_at": node["createdAt"],
-            "created_by": get_user("author", node),
-            "closed_at": node["closedAt"],
-            "closed_by": (
-                get_user("actor", node["timelineItems"]["nodes"][0])
-                if node["closedAt"] and node["timelineItems"]["nodes"]
-                else None
-            ),
-            "labels": [label_node["name"] for label_node in node["labels"]["nodes"]]
-        }
-        issues.add(Issue(**data))
+    for node in payload["nodes"]:
+        issues.add(_parse_graphql_issue_node(node, is_pr=is_pr))
 
     return issues
 
 
 def fetch_issues_graphql(repo: Repo, fetcher: Fetcher) -> IssueSet:
     issues = IssueSet()
-    query = ISSUES_QUERY.replace("psf", repo.owner).replace("black", repo.name)
-    for kind in ("issues", "pullRequests"):
-        kind_issues = IssueSet()
-        next_page_cursor = None
-        more_pages = True
-        while more_pages:
-            this_query = query.replace("kind", kind)
-            if next_page_cursor:
-                this_query = this_query.replace("null", f'"{next_page_cursor}"')
-            r = fetcher.request("POST", "", json={"query": this_query})
-
-            query_data = r.json()["data"]["repository"][kind]
-            kind_issues.extend(_parse_graphql_issues_json(query_data, is_pr=(kind != "issues")))
-            skind = kind if kind == "issues" else "pull requests"
-            print(f"\rFetching {skind} ...", len(kind_issues), end="", flush=True)
-
-            more_pages = query_data["pageInfo"]["hasNextPage"]
-            next_page_cursor = query_data["pageInfo"]["endCursor"]
-        issues.extend(kind_issues)
-        print()
+
+    def fetch_page(kind: str, cursor: Optional[str]) -> Any:
+        # Everything that changes between pages is passed as a variable, so the
+        # query text itself stays the same.
+        variables = {
+            "owner": repo.owner,
+            "name": repo.name,
+            "cursor": cursor,
+            "pulls": kind == "pullRequests",
+        }
+        r = fetcher.request("POST", "", json={"query": ISSUES_QUERY, "variables": variables})
+        return _parse_json(r)["data"]["repository"][kind]
+
+    # Each page's cursor comes from the previous page, but as soon as we have it, the
+    # next page can be requested in the background while this one is being parsed.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for kind in ("issues", "pullRequests"):
+            kind_issues = IssueSet()
+            future = executor.submit(fetch_page, kind, None)
+            while future is not None:
+                query_data = future.result()
+                page_info = query_data["pageInfo"]
+                if page_info["hasNextPage"]:
+                    future = executor.submit(fetch_page, kind, page_info["endCursor"])
+                else:
+                    future = None
+
+                kind_issues.extend(
+                    _parse_graphql_issues_json(query_data, is_pr=(kind != "issues"))
+                )
+                skind = kind if kind == "issues" else "pull requests"
+                print(f"\rFetching {skind} ...", len(kind_issues), end="", flush=True)
+            issues.extend(kind_issues)
+            print()
 
     return issues
 
 
-def fetch_issue_data(repo: Repo, issue: Issue, fetcher: Fetcher) -> Issue:
-    endpoint = "pulls" if issue.is_pr else "issues"
-    url = f"/repos/{repo.owner}/{repo.name}/{endpoint}/{issue.number}"
-    resp = fetcher.get(url)
-    return Issue(**resp.json())
+def fetch_issue_data(url: str, issue: Issue, fetcher: Fetcher) -> Issue:
+    """Fill in what the issue list endpoint doesn't return for issue (who closed it).
+
+    url is the issue's REST API endpoint.
+    """
+    # Not a conditional request: issues only end up here when they were closed since
+    # we last saw them, so a stored ETag could never match.
+    closed_by_data = _parse_json(fetcher.get(url)).get("closed_by")
+    closed_by = closed_by_data["login"] if closed_by_data else None
+    return attrs.evolve(issue, closed_by=closed_by)
 
 
 def fetch_issueset_data(
-    repo: Repo, to_fetch: IssueSet, container: IssueSet, fetcher: Fetcher
+    repo: Repo,
+    to_fetch: IssueSet,
+    container: IssueSet,
+    fetcher: Fetcher,
+    *,
+    progress: bool = True,
 ) -> IssueSet:
     count = len(to_fetch)
     fetched = 0
 
-    print(f"Fetching issues and pull requests ... 0/{count}", end="", flush=True)
-    for i in to_fetch:
-        issue = fetch_issue_data(repo, i, fetcher)
+    # Redrawing the progress line for every single issue is pointless (and a lot of
+    # syscalls), so only do so every percent.
+    step = max(1, count // 100)
+
+    if progress:
+        print(f"Fetching issues and pull requests ... 0/{count}", end="", flush=True)
+    # The issues endpoint works for pull requests too, and unlike the pulls endpoint,
+    # it includes closed_by.
+    issues_url = f"/repos/{repo.owner}/{repo.name}/issues/"
+    jobs = ((issues_url + str(i.number), i, fetcher) for i in to_fetch)
+    for issue in _map_concurrently(fetch_issue_data, jobs):
         container[issue.number] = issue
         fetched += 1
-        print(
-            "\rFetching issues and pull requests ..."
-            f" {fetched}/{count} ({int(fetched / count * 100)}%)",
-            end="",
-            flush=True,
-        )
-    print()
+        if progress and (fetched % step == 0 or fetched == count):
+            print(
+                "\rFetching issues and pull requests ..."
+                f" {fetched}/{count} ({fetched * 100 // count}%)",
+                end="",
+                flush=True,
+            )
+    if progress:
+        print()
+
+    return container
+
+
+def merge_enumerated_issues(enumerated: IssueSet, container: IssueSet) -> IssueSet:
+    """Store issues from enumerate_issues() in container, returning those that need more detail.
+
+    The issue list endpoint returns everything we keep except for who closed an issue.
+    Only issues that were closed (or closed again) since we last saw them need to be
+    fetched individually.
+    """
+    needs_detail = IssueSet()
+    for i in enumerated:
+        if not i.closed:
+            container[i.number] = i
+        elif i in container and container[i].closed_at == i.closed_at:
+            container[i.number] = attrs.evolve(i, closed_by=container[i].closed_by)
+        else:
+            needs_detail.add(i)
+
+    return needs_detail
+
+
+def _build_issue_batch_query(numbers: Iterable[int]) -> str:
+    aliases = "\n".join(
+        f"    i{n}: issueOrPullRequest(number: {n}) {{\n"
+        "      ...issueCloser\n"
+        "      ...pullRequestCloser\n"
+        "    }"
+        for n in numbers
+    )
+    return (
+        "query GraphQLQuery($owner: String!, $name: String!) {\n"
+        "  repository(name: $name, owner: $owner) {\n"
+        f"{aliases}\n"
+        "  }\n"
+        "  rateLimit {\n"
+        "    limit\n"
+        "    remaining\n"
+        "    resetAt\n"
+        "  }\n"
+        "}\n\n"
+        + CLOSER_FRAGMENTS
+    )
+
+
+def fetch_issueset_data_graphql(
+    repo: Repo,
+    to_fetch: IssueSet,
+    container: IssueSet,
+    fetcher: Fetcher,
+    rest_fetcher: Fetcher,
+    *,
+    progress: bool = True,
+) -> IssueSet:
+    """Like fetch_issueset_data(), but batches many issues into each GraphQL query.
+
+    Issues the GraphQL API didn't return are fetched individually via REST (using
+    rest_fetcher).
+    """
+    count = len(to_fetch)
+    fetched = 0
+    numbers = sorted(int(i) for i in to_fetch)
+    missing = IssueSet()
+
+    if progress:
+        print(f"Fetching issues and pull requests ... 0/{count}", end="", flush=True)
+    for start in range(0, count, ISSUE_BATCH_SIZE):
+        batch = numbers[start:start + ISSUE_BATCH_SIZE]
+        query = _build_issue_batch_query(batch)
+        variables = {"owner": repo.owner, "name": repo.name}
+        r = fetcher.request("POST", "", json={"query": query, "variables": variables})
+
+        repo_data = _parse_json(r)["data"]["repository"] or {}
+        for n in batch:
+            node = repo_data.get(f"i{n}")
+            if node is None:
+                missing.add(to_fetch[n])
+                continue
+            closed_by = _parse_graphql_closer(node) if to_fetch[n].closed else None
+            container[n] = attrs.evolve(to_fetch[n], closed_by=closed_by)
+        fetched += len(batch)
+        if progress:
+            print(
+                "\rFetching issues and pull requests ..."
+                f" {fetched}/{count} ({fetched * 100 // count}%)",
+                end="",
+                flush=True,
+            )
+    if progress:
+        print()
+
+    if missing:
+        if progress:
+            print(
+                f"GraphQL API didn't return {len(missing)} issues of {repo},"
+                " falling back to REST."
+            )
+        fetch_issueset_data(repo, missing, container, rest_fetcher, progress=progress)
 
     return container
 
@@ -254,7 +714,10 @@ def repo_callback(ctx: click.Context, param: click.Parameter, value: str) -> Rep
 @click.option(
     "--api-key",
     envvar="GITHUB_API_KEY",
-    help="GitHub PAT to authenticate with the GitHub API.",
+    help=(
+        "GitHub PAT to authenticate with the GitHub API. Pass multiple comma-separated"
+        " tokens to spread requests across them."
+    ),
 )
 @click.option("--debug", is_flag=True, help="Print debug information.")
 @click.pass_context
@@ -268,8 +731,13 @@ def main(ctx: click.Context, id: str, api_key: str, debug: bool) -> None:
     def _elapsed() -> float:
         return time.perf_counter() - t0
 
-    fetcher = Fetcher(api="rest", auth=(id, api_key), debug=debug)
-    ctx.obj = {"fetcher": fetcher, "elapsed": _elapsed, "current-dt": get_current_datetime()}
+    tokens = [t.strip() for t in api_key.split(",") if t.strip()]
+    ctx.obj = {
+        "fetcher": RestFetcher(username=id, tokens=tokens, debug=debug),
+        "graphql-fetcher": GraphQLFetcher(username=id, tokens=tokens, debug=debug),
+        "elapsed": _elapsed,
+        "current-dt": get_current_datetime(),
+    }
 
 
 @main.command(help="Fetch and save all issue data to a file.")
@@ -284,10 +752,9 @@ def main(ctx: click.Context, id: str, api_key: str, debug: bool) -> None:
 def fetch(ctx: click.Context, output_path: Path, repo: Repo) -> None:
     elapsed = ctx.obj["elapsed"]
 
-    with ctx.obj["fetcher"] as fetcher:
+    with ctx.obj["graphql-fetcher"] as fetcher:
         # issues = enumerate_issues(repo, fetcher)
         # issues = fetch_issueset_data(repo, issues, issues, fetcher)
-        fetcher.api = "graphql"
         issues = fetch_issues_graphql(repo, fetcher)
 
     record = Record(last_updated=ctx.obj["current-dt"], repo=repo)
@@ -298,6 +765,65 @@ def fetch(ctx: click.Context, output_path: Path, repo: Repo) -> None:
     print(f"Command took {elapsed():.3f} seconds to complete.")
 
 
+def update_data_file(
+    data_file: Path, fetcher: Fetcher, graphql_fetcher: Fetcher, *, progress: bool = True
+) -> UpdateResult:
+    """Bring the issues in data_file up to date (without saving them).
+
+    Returns the updated issues, the file's record, the issues that changed, the
+    numbers of all issues and of closed issues from before the update, and the
+    ETags to save alongside the file.
+    """
+    issue_set, record = ghlib.load(data_file)
+    # The summary only needs to know which issues existed and which were closed, no
+    # need to copy the whole set.
+    original_numbers = frozenset(i.number for i in issue_set)
+    originally_closed = frozenset(i.number for i in issue_set if i.closed)
+    fetcher.etags.update(ghlib.load_etags(data_file))
+
+    outdated = enumerate_issues(record.repo, fetcher, record.last_updated, progress=progress)
+    needs_detail = merge_enumerated_issues(outdated, issue_set)
+    if needs_detail:
+        fetch_issueset_data_graphql(
+            record.repo, needs_detail, issue_set, graphql_fetcher, fetcher, progress=progress
+        )
+
+    # Only the issue listing is fetched conditionally. Other updates may be adding
+    # ETags to the shared dict right now, so filter a copy (taken in one step).
+    prefix = f"/repos/{record.repo}/issues?"
+    etags = {url: etag for url, etag in fetcher.etags.copy().items() if url.startswith(prefix)}
+
+    return issue_set, record, outdated, original_numbers, originally_closed, etags
+
+
+def save_update(data_file: Path, result: UpdateResult, current_dt: datetime) -> None:
+    """Print a summary of the changes update_data_file() made and save them."""
+    updated_issues, record, outdated, original_numbers, originally_closed, etags = result
+    if not outdated:
+        ghlib.save_etags(etags, data_file)
+        print()
+        return
+
+    # Build the whole summary first so it's written out in one go.
+    summary = ["Summary of changes:"]
+    for i in outdated:
+        kind = "pull request" if i.is_pr else "issue"
+        if i.number not in original_numbers:
+            change = CHANGE_NEW
+        elif i.closed and i.number not in originally_closed:
+            change = CHANGE_CLOSED
+        else:
+            change = CHANGE_UPDATED
+        summary.append(f"  {change} - {kind} {int(i)} '{i.title}'")
+    click.echo("\n".join(summary))
+
+    new_record = attrs.evolve(record, last_updated=current_dt)
+    print("Saving updated data ... ", end="")
+    ghlib.save(updated_issues, new_record, data_file)
+    ghlib.save_etags(etags, data_file)
+    print("done\n")
+
+
 @main.command(help="Update files holding issue and pull request data.")
 @click.argument(
     "data-files",
@@ -307,45 +833,50 @@ def fetch(ctx: click.Context, output_path: Path, repo: Repo) -> None:
 @click.pass_context
 def update(ctx: click.Context, data_files: Iterable[Path]) -> None:
     elapsed = ctx.obj["elapsed"]
-
-    with ctx.obj["fetcher"] as fetcher:
-        for df in data_files:
-            secho(f"Update operation for {df!s} starting", bold=True)
-            print("Loading data file ... ", end="")
-            issue_set, record = ghlib.load(df)
-            original_issue_set = IssueSet(issue_set)
-            print("done")
-
-            outdated = enumerate_issues(record.repo, fetcher, record.last_updated)
-            if not outdated:
-                print()
-                continue
-
-            updated_issues = fetch_issueset_data(record.repo, outdated, issue_set, fetcher)
-
-            print("Summary of changes:")
-            for i in outdated:
-                kind = "pull request" if i.is_pr else "issue"
-                if i.number not in original_issue_set:
-                    styling = "green"
-                    change = "NEW"
-                else:
-                    if not original_issue_set[i].closed and i.closed:
-                        styling = "red"
-                        change = "CLOSED"
-                    else:
-                        styling = "yellow"
-                        change = "UPDATED"
-                secho("  " + click.style(change, fg=styling), nl=False)
-                print(f" - {kind} {int(i)} '{i.title}'")
-
-            new_record = attrs.evolve(record, last_updated=ctx.obj["current-dt"])
-            print("Saving updated data ... ", end="")
-            ghlib.save(updated_issues, new_record, df)
-            print("done\n")
+    data_files = list(data_files)
+
+    fetcher = ctx.obj["fetcher"]
+    graphql_fetcher = ctx.obj["graphql-fetcher"]
+    current_dt = ctx.obj["current-dt"]
+    failed = []
+    with fetcher, graphql_fetcher:
+        if len(data_files) == 1:
+            secho(f"Update operation for {data_files[0]!s} starting", bold=True)
+            result = update_data_file(data_files[0], fetcher, graphql_fetcher)
+            save_update(data_files[0], result, current_dt)
+        else:
+            # The data files are independent so update them all at once. Progress output
+            # from concurrent updates would be an unreadable mess so it's turned off.
+            # Each file is saved as soon as its update (and those before it) are done,
+            # and a failure only loses that file's update.
+            print(f"Updating {len(data_files)} data files ...\n")
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPDATES) as executor:
+                job = partial(
+                    update_data_file,
+                    fetcher=fetcher,
+                    graphql_fetcher=graphql_fetcher,
+                    progress=False,
+                )
+                pending = [(df, executor.submit(job, df)) for df in data_files]
+                # Popping drops each result as soon as it's saved.
+                pending.reverse()
+                while pending:
+                    df, future = pending.pop()
+                    secho(f"Update operation for {df!s}", bold=True)
+                    try:
+                        save_update(df, future.result(), current_dt)
+                    except Exception as e:
+                        secho(f"Failed to update {df!s}: {e}\n", fg="red")
+                        failed.append(df)
+                    del future
 
     print_rate_limit(fetcher.rate_limit())
+    if graphql_fetcher.has_rate_limit:
+        print_rate_limit(graphql_fetcher.rate_limit())
     print(f"Command took {elapsed():.3f} seconds to complete.")
+    if failed:
+        secho(f"{len(failed)} of {len(data_files)} data files failed to update.", fg="red")
+        ctx.exit(1)
 
 
 if __name__ == "__main__":
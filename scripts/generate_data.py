@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 
-import json
-from collections import defaultdict
+from bisect import bisect_left
 from datetime import date, datetime, timedelta
 from functools import wraps
+from itertools import accumulate
 from pathlib import Path
 from typing import Any, Callable, Iterable, Iterator, List, Tuple
 
@@ -70,17 +70,18 @@ def generate_command_args(func: Callable) -> Callable:
 
 
 def cal_open_issues_over_time(days, issues: Iterable[Issue]):
-    issues_per_day = []
-    for day in days:
-        open_ = 0
-        for i in issues:
-            if i.created_at.date() <= day:
-                if i.closed_at is None:
-                    open_ += 1
-                elif i.closed_at.date() > day:
-                    open_ += 1
-        issues_per_day.append(open_)
-    return issues_per_day
+    # Instead of checking every issue for every day, record where (in days) each issue
+    # opens and closes and then take a running total. Comparing ordinals (plain ints)
+    # avoids creating a date object for each timestamp.
+    ordinals = [day.toordinal() for day in days]
+    changes = [0] * (len(days) + 1)
+    for i in issues:
+        opened = bisect_left(ordinals, i.created_at.toordinal())
+        changes[opened] += 1
+        if i.closed_at is not None:
+            closed = bisect_left(ordinals, i.closed_at.toordinal())
+            changes[max(opened, closed)] -= 1
+    return list(accumulate(changes[:-1]))
 
 
 def get_rid_of_prs(issues):
@@ -91,10 +92,6 @@ def get_closed_issues(issues):
     return IssueSet([i for i in issues if i.closed_at is not None])
 
 
-def get_closers(issues):
-    return set([i.closed_by for i in issues])
-
-
 def timeseries_line_dataset(label: str, data: List[int], days: List[date]) -> Any:
     return {"label": label, "data": [{"x": dt.isoformat(), "y": n} for dt, n in zip(days, data)]}
 
@@ -113,11 +110,22 @@ def issue_counts(data_file: Path, output: Path, labels: Iterable[Tuple[str, str]
     print("[*] Data file loaded")
     days = get_days(issues)
 
-    issues = IssueSet(i for i in issues if not i.is_pr)
-    group_data = {"total": issues}
+    group_labels = {}
     for group, gh_label in labels:
         assert group != "total", "'total' is used internally by ghstats, please use a different group name"
-        group_data[group] = IssueSet(i for i in issues if gh_label in i.labels)
+        group_labels[group] = gh_label
+
+    # Sort every issue into its groups in one pass rather than one pass per group.
+    group_data = {"total": [], **{group: [] for group in group_labels}}
+    for i in issues:
+        if i.is_pr:
+            continue
+        group_data["total"].append(i)
+        if group_labels:
+            issue_labels = set(i.labels)
+            for group, gh_label in group_labels.items():
+                if gh_label in issue_labels:
+                    group_data[group].append(i)
 
     print("[*] Data preparation finished")
 
@@ -130,8 +138,7 @@ def issue_counts(data_file: Path, output: Path, labels: Iterable[Tuple[str, str]
         timeseries_line_dataset(f"open issues ({group})", ydata, days)
         for group, ydata in group_data.items()
     ]
-    blob = json.dumps(data, indent=2)
-    output.write_text(blob)
+    output.write_bytes(ghlib.dumps(data))
 
 
 @main.command("pull-counts")
@@ -151,8 +158,7 @@ def pr_counts(data_file: Path, output: Path) -> None:
     print("[*] Data chrunching finished")
 
     data = [timeseries_line_dataset("open PRs", ydata, days)]
-    blob = json.dumps(data, indent=2)
-    output.write_text(blob)
+    output.write_bytes(ghlib.dumps(data))
 
 
 @main.command("issue-closers")
@@ -164,36 +170,23 @@ def issue_closers(data_file: Path, output: Path) -> None:
     days = get_days(issues)
 
     def prepare_data_collection(days, closers):
-        template = []
-        for day in days:
-            close_data_template = {}
-            for c in closers:
-                close_data_template[c.closed_by] = [0, 0]
-            template.append(close_data_template)
+        # Closes by someone other than the issue author are tracked per closer, the
+        # rest are lumped together under "{issue-author}".
+        template = {}
+        for c in closers:
+            template[c.closed_by] = [0] * (len(days) + 1)
+        template["{issue-author}"] = [0] * (len(days) + 1)
         return template
 
     def cal_closes_over_time(template, days, issues):
-        for idx, day in enumerate(days):
-            for i in issues:
-                if i.closed_at.date() <= day:
-                    index = 0
-                    if i.created_by == i.closed_by:
-                        index = 1
-                    template[idx][i.closed_by][index] += 1
-        return template
+        ordinals = [day.toordinal() for day in days]
+        for i in issues:
+            group = "{issue-author}" if i.created_by == i.closed_by else i.closed_by
+            template[group][bisect_left(ordinals, i.closed_at.toordinal())] += 1
+        return {group: list(accumulate(changes[:-1])) for group, changes in template.items()}
 
     def parse_closing_data(data):
-        groups = defaultdict(list)
-        for day_data in data:
-            default_close = 0
-            for user, close_data in day_data.items():
-                groups[user].append(close_data[0])
-                default_close += close_data[1]
-            groups["{issue-author}"].append(default_close)
-        kill = {name for name, data in groups.items() if all(not day for day in data)}
-        for target in kill:
-            del groups[target]
-        return groups
+        return {name: counts for name, counts in data.items() if any(counts)}
 
     closed_issues = get_closed_issues(get_rid_of_prs(issues))
     template = prepare_data_collection(days, closed_issues)
@@ -208,8 +201,7 @@ def issue_closers(data_file: Path, output: Path) -> None:
     data = []
     for gname, ydata in parsed_data.items():
         data.append(timeseries_line_dataset(gname, ydata, days))
-    blob = json.dumps(data, indent=2)
-    output.write_text(blob)
+    output.write_bytes(ghlib.dumps(data))
 
 
 @main.command("issue-deltas")
@@ -238,8 +230,7 @@ def issue_deltas(data_file: Path, output: Path) -> None:
     print("[*] Data chrunching finished")
 
     data = [timeseries_line_dataset("changes (issues)", ydata, months)]
-    blob = json.dumps(data, indent=2)
-    output.write_text(blob)
+    output.write_bytes(ghlib.dumps(data))
 
 
 if __name__ == "__main__":
@@ -1,66 +1,84 @@
 from __future__ import annotations
 
 import json
+import sys
 from datetime import datetime
-from functools import partial
-from operator import attrgetter
 from pathlib import Path
-from typing import Any, Collection, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from typing import Any, Collection, Dict, Iterable, Iterator, Optional, Tuple, Union
 
 import attrs
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 JSON = Dict[str, Any]
 
 
-def serialize(inst: type, field: attrs.Attribute, value: object) -> object:
-    if isinstance(value, datetime):
-        return value.isoformat()
-    if isinstance(value, IssueSet):
-        return list(sorted(value._issues.values(), key=attrgetter("number")))
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
-    return value
 
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    # Same bytes as orjson, which writes non-ASCII text as is.
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
 
-asdict = partial(attrs.asdict, value_serializer=serialize)
 
+def convert_iso8601_string(string: Union[str, datetime, None]) -> Optional[datetime]:
+    if isinstance(string, datetime):
+        # Already converted (e.g. via attrs.evolve).
+        return string
+    if not string:
+        return None
+    # fromisoformat is implemented in C and much faster than strptime, but only
+    # accepts the "Z" suffix GitHub uses from Python 3.11 onwards.
+    if string.endswith("Z"):
+        string = string[:-1] + "+00:00"
+    return datetime.fromisoformat(string)
 
-def convert_iso8601_string(string: Optional[str]) -> Optional[datetime]:
-    return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S%z") if string else None
 
+def intern_strings(strings: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(map(sys.intern, strings))
 
-@attrs.frozen
+
+# Nothing holds weak references to issues, so that slot is better spent on the hash.
+@attrs.frozen(cache_hash=True, weakref_slot=False)
 class Issue:
     """Read-only issue data and metadata representation object."""
 
     number: int
     title: str
-    labels: List[str]
+    # A tuple (not a list) so issues are hashable like a frozen class should be.
+    # Labels and usernames repeat across thousands of issues, so they're interned to
+    # share one string object per distinct value.
+    labels: Tuple[str, ...] = attrs.field(converter=intern_strings)
     is_pr: bool
     created_at: datetime = attrs.field(converter=convert_iso8601_string)
-    created_by: str
+    created_by: str = attrs.field(converter=sys.intern)
     closed_at: Optional[datetime] = attrs.field(default=None, converter=convert_iso8601_string)
-    closed_by: Optional[str] = None
-
-    def __init__(self, **kwargs: Any) -> None:
-        api_format = "login" in kwargs or "created_by" not in kwargs
-        if api_format:
-            created_by = kwargs.pop("user")["login"]
-            closed_by = None
-            if "closed_by" in kwargs:
-                closed_by_data = kwargs.pop("closed_by")
-                closed_by = closed_by_data["login"] if closed_by_data else None
-            is_pr = "pull_request" in kwargs or "merged_at" in kwargs
-            labels = [l["name"] for l in kwargs.pop("labels")]
-            filtered = {
-                attribute.name: kwargs[attribute.name]
-                for attribute in self.__attrs_attrs__
-                if attribute.name in kwargs
-            }
-            self.__attrs_init__(
-                **filtered, created_by=created_by, closed_by=closed_by, is_pr=is_pr, labels=labels
-            )
-        else:
-            self.__attrs_init__(**kwargs)
+    closed_by: Optional[str] = attrs.field(
+        default=None, converter=attrs.converters.optional(sys.intern)
+    )
+
+    @classmethod
+    def from_api(cls, data: JSON) -> "Issue":
+        """Create an issue from a REST API issue (or pull request) object."""
+        closed_by_data = data.get("closed_by")
+        return cls(
+            number=data["number"],
+            title=data["title"],
+            labels=tuple(label["name"] for label in data["labels"]),
+            is_pr="pull_request" in data or "merged_at" in data,
+            created_at=data["created_at"],
+            created_by=data["user"]["login"] if data["user"] else "ghost",
+            closed_at=data.get("closed_at"),
+            closed_by=closed_by_data["login"] if closed_by_data else None,
+        )
 
     def __int__(self) -> int:
         return self.number
@@ -85,11 +103,9 @@ class IssueSet(Collection[Issue]):
 
     def extend(self, issues: Union["IssueSet", Iterable[Issue]]) -> None:
         if isinstance(issues, IssueSet):
-            issues_as_dict = issues._issues
-        elif isinstance(issues, Iterable):
-            issues_as_dict = IssueSet(issues)._issues
-
-        self._issues.update(issues_as_dict)
+            self._issues.update(issues._issues)
+        else:
+            self._issues.update((i.number, i) for i in issues)
 
     def oldest(self) -> Issue:
         return self._issues[min(self._issues)]
@@ -176,19 +192,64 @@ class Record:
     version: int = 1
 
 
+def _issue_to_dict(i: Issue) -> JSON:
+    # Written out by hand since attrs.asdict's generic (recursive) conversion is much
+    # slower for something done for every single issue.
+    return {
+        "number": i.number,
+        "title": i.title,
+        "labels": i.labels,
+        "is_pr": i.is_pr,
+        "created_at": i.created_at.isoformat(),
+        "created_by": i.created_by,
+        "closed_at": i.closed_at.isoformat() if i.closed_at else None,
+        "closed_by": i.closed_by,
+    }
+
+
+def _record_to_dict(r: Record) -> JSON:
+    return {
+        "repo": {"owner": r.repo.owner, "name": r.repo.name},
+        "last_updated": r.last_updated.isoformat(),
+        "version": r.version,
+    }
+
+
 def save(issues: IssueSet, record: Record, output_path: Path) -> None:
     data = {
-        "issues": [asdict(i) for i in sorted(issues, key=attrgetter("number"))],
-        "record": asdict(record),
+        # Sorting the (int) keys is cheaper than sorting issues by an attribute.
+        "issues": [_issue_to_dict(issues._issues[n]) for n in sorted(issues._issues)],
+        "record": _record_to_dict(record),
     }
-    output_path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    output_path.write_bytes(dumps(data))
 
 
 def load(data_path: Path) -> Tuple[IssueSet, Record]:
-    data = json.loads(data_path.read_text("utf-8"))
+    data = loads(data_path.read_bytes())
 
     last_updated = convert_iso8601_string(data["record"]["last_updated"])
     assert last_updated is not None
     repo = Repo(**data["record"]["repo"])
 
-    return IssueSet.from_json(data["issues"]), Record(repo, last_updated)
+    # Drop each raw dictionary as soon as its Issue is built so the parsed document
+    # and the IssueSet don't both have to fit in memory at their full size.
+    raw_issues = data.pop("issues")
+    raw_issues.reverse()
+    issues = IssueSet(Issue(**raw_issues.pop()) for _ in range(len(raw_issues)))
+    return issues, Record(repo, last_updated)
+
+
+def etag_cache_path(data_path: Path) -> Path:
+    return data_path.with_name("etag_cache.json")
+
+
+def save_etags(etags: Dict[str, str], data_path: Path) -> None:
+    etag_cache_path(data_path).write_bytes(dumps(dict(sorted(etags.items()))))
+
+
+def load_etags(data_path: Path) -> Dict[str, str]:
+    cache_path = etag_cache_path(data_path)
+    if not cache_path.exists():
+        return {}
+
+    return loads(cache_path.read_bytes())
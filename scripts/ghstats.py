@@ -1,14 +1,17 @@
-import json
-import shutil
+from __future__ import annotations
+
+import io
+import os
+from contextlib import redirect_stdout
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 import attrs
 import click
 from click import confirm, prompt
 
-from . import ghlib
-from .ghlib import Repo
+if TYPE_CHECKING:
+    from .ghlib import Repo
 
 THIS_DIR = Path(__file__).parent
 ROOT_DIR = THIS_DIR.parent
@@ -24,14 +27,21 @@ VIEWS = {
 JSON = Dict[str, Any]
 
 
+# The styling only depends on the level, so it's built once here instead of per call.
+# Warnings and errors are bold throughout, otherwise only the prefix is.
+LOG_PREFIXES = {
+    "info": (
+        click.style("[ghstats] ", bold=True, fg="magenta")
+        + click.style("", fg="magenta", reset=False)
+    ),
+    "warning": click.style("[ghstats] ", bold=True, fg="yellow", reset=False),
+    "error": click.style("[ghstats] ", bold=True, fg="red", reset=False),
+}
+LOG_SUFFIX = click.style("")
+
+
 def log(msg: str, level: str = "info") -> None:
-    bold = level in ("warning", "error")
-    color = {"info": "magenta", "warning": "yellow", "error": "red"}[level]
-    if bold:
-        formatted = click.style(f"[ghstats] {msg}", bold=True, fg=color)
-    else:
-        formatted = click.style("[ghstats] ", bold=True, fg=color) + click.style(msg, fg=color)
-    click.secho(formatted)
+    click.echo(LOG_PREFIXES[level] + msg + LOG_SUFFIX)
 
 
 @attrs.frozen
@@ -51,21 +61,25 @@ class Config:
 
     @classmethod
     def load_path(cls, path: Path) -> "Config":
-        data = json.loads(path.read_text())
+        from .ghlib import Repo, loads
+
+        data = loads(path.read_bytes())
         data["repos"] = {Repo.parse(r): repo_config for r, repo_config in data["repos"].items()}
         if "author" in data:
             data["author"] = AuthorInfo(**data["author"])
         return cls(**data)
 
     def save_path(self, path: Path) -> None:
-
-        def serialize(instance: Any, field: attrs.Attribute, value: Any) -> Any:
-            if isinstance(instance, self.__class__) and field.name == "repos":
-                return {str(r): config for r, config in value.items()}
-            return value
-
-        blob = json.dumps(attrs.asdict(self, value_serializer=serialize), indent=2)
-        path.write_text(blob + "\n", encoding="utf-8")
+        from .ghlib import dumps
+
+        data = {
+            "title": self.title,
+            "username": self.username,
+            "base_path": self.base_path,
+            "repos": {str(r): config for r, config in self.repos.items()},
+            "author": {"name": self.author.name, "link": self.author.link},
+        }
+        path.write_bytes(dumps(data) + b"\n")
 
 
 @click.group
@@ -80,12 +94,20 @@ class Config:
 def main(ctx: click.Context, config_path: Path) -> None:
     ctx.obj = {}
     ctx.obj["config-path"] = config_path
-    ctx.obj["config"] = Config.load_path(config_path)
+
+
+def get_config(ctx: click.Context) -> Config:
+    # The configuration is only loaded once a command actually needs it.
+    if "config" not in ctx.obj:
+        ctx.obj["config"] = Config.load_path(ctx.obj["config-path"])
+    return ctx.obj["config"]
 
 
 @main.command("setup", help="Set up a new instance of GHstats.")
 @click.pass_context
 def setup_instance(ctx: click.Context) -> None:
+    import shutil
+
     if WEB_DIR.exists():
         shutil.rmtree(WEB_DIR)
         log("Deleted web directory.")
@@ -105,7 +127,9 @@ def setup_instance(ctx: click.Context) -> None:
 @click.argument("repo_str", metavar="$owner/$name", required=False)
 @click.pass_context
 def add_repository(ctx: click.Context, repo_str: Optional[str]) -> None:
-    config, config_path = ctx.obj["config"], ctx.obj["config-path"]
+    from .ghlib import Repo
+
+    config, config_path = get_config(ctx), ctx.obj["config-path"]
     if not repo_str:
         repo_str = prompt("Repository ($owner/$name)")
 
@@ -122,11 +146,29 @@ def add_repository(ctx: click.Context, repo_str: Optional[str]) -> None:
     ctx.invoke(generate_html)
 
 
+def copy_if_changed(src: str, dst: str) -> None:
+    """Like shutil.copy2, but skip files that were already copied and haven't changed since."""
+    import shutil
+
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except FileNotFoundError:
+        pass
+    else:
+        # copy2 preserves the modification time, so matching size and mtime means
+        # this is the file we copied last time.
+        if (src_stat.st_size, src_stat.st_mtime_ns) == (dst_stat.st_size, dst_stat.st_mtime_ns):
+            return
+    shutil.copy2(src, dst)
+
+
 @main.command("generate-html", help="Generate web directory.")
 @click.pass_context
 def generate_html(ctx: click.Context) -> None:
     # https://realpython.com/primer-on-jinja-templating/
-    config = ctx.obj["config"]
+    import shutil
+
+    config = get_config(ctx)
     try:
         from jinja2 import Environment, FileSystemLoader
     except ImportError:
@@ -162,14 +204,16 @@ def generate_html(ctx: click.Context) -> None:
     vite_config = vite_template.render(repositories=config.repos)
     (WEB_DIR / "vite.config.js").write_text(vite_config, "utf-8")
     log("Wrote Vite build configuration.")
-    shutil.copytree(ROOT_DIR / "assets", WEB_DIR / "_assets", dirs_exist_ok=True)
+    shutil.copytree(
+        ROOT_DIR / "assets", WEB_DIR / "_assets", copy_function=copy_if_changed, dirs_exist_ok=True
+    )
     log("Copied static assets. Web directory is ready!")
 
 
 @main.command("base-path", help="(INTERNAL) Print base path.")
 @click.pass_context
 def print_base_path(ctx: click.Context) -> None:
-    config = ctx.obj["config"]
+    config = get_config(ctx)
     click.echo(config.base_path)
 
 
@@ -179,7 +223,8 @@ def print_base_path(ctx: click.Context) -> None:
 def fetch_issue_data(ctx: click.Context, base_path: Path) -> None:
     from . import download
 
-    config = ctx.obj["config"]
+    config = get_config(ctx)
+    to_update: Dict[Repo, Path] = {}
     for r in config.repos:
         repo_path = Path(base_path, r.owner, r.name)
         data_path = Path(repo_path, "issues.json")
@@ -191,21 +236,39 @@ def fetch_issue_data(ctx: click.Context, base_path: Path) -> None:
                 standalone_mode=False
             )
         else:
-            log(f"Updating {r}.")
-            assert data_path.exists(), f"{data_path} should exist!"
-            download.main(
-                ["--id", config.username, "update", str(data_path)],
-                standalone_mode=False,
-            )
+            to_update[r] = data_path
+
+    if to_update:
+        # One update invocation for everything so the repositories are updated
+        # concurrently over a shared connection pool. Each repository is saved on its
+        # own, so one failing doesn't throw away the others.
+        log(f"Updating {', '.join(map(str, to_update))}.")
+        exit_code = download.main(
+            ["--id", config.username, "update", *map(str, to_update.values())],
+            standalone_mode=False,
+        )
+        if exit_code:
+            log("Some repositories failed to update.", "error")
+            ctx.exit(exit_code)
+
+
+def run_generate_data(args: List[str]) -> str:
+    """Run a generate_data command, returning what it printed."""
+    from . import generate_data
+
+    with redirect_stdout(io.StringIO()) as output:
+        generate_data.main(args, standalone_mode=False)
+    return output.getvalue()
 
 
 @main.command("generate-ghstats-data", help="Generate data files used by GHstats' front-end.")
 @click.argument("base-path", type=click.Path(exists=True, file_okay=False, path_type=Path))
 @click.pass_context
 def generate_ghstats_data(ctx: click.Context, base_path: Path) -> None:
-    from . import generate_data
+    from concurrent.futures import ProcessPoolExecutor
 
-    config = ctx.obj["config"]
+    config = get_config(ctx)
+    jobs = []
     for r, repo_config in config.repos.items():
         data_path = Path(base_path, r.owner, r.name, "issues.json")
         if not data_path.exists():
@@ -213,7 +276,6 @@ def generate_ghstats_data(ctx: click.Context, base_path: Path) -> None:
             continue
 
         for cmd in repo_config["views"]:
-            log(f"Generating '{cmd}' for {r}")
             out_path = data_path.with_name(cmd + ".json")
             args = [cmd, str(data_path), "--output", str(out_path)]
 
@@ -221,7 +283,21 @@ def generate_ghstats_data(ctx: click.Context, base_path: Path) -> None:
                 for group, gh_label in repo_config["view:issue-counts:groups"].items():
                     args.extend(("--show-label", group, gh_label))
 
-            generate_data.main(args, standalone_mode=False)
+            jobs.append((f"Generating '{cmd}' for {r}", args))
+
+    if len(jobs) <= 1:
+        for message, args in jobs:
+            log(message)
+            click.echo(run_generate_data(args), nl=False)
+        return
+
+    # Every view is independent and CPU-bound, so they're generated in parallel
+    # worker processes. Results (and output) are reported in order.
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(run_generate_data, args) for _, args in jobs]
+        for (message, _), future in zip(jobs, futures):
+            log(message)
+            click.echo(future.result(), nl=False)
 
 
 if __name__ == "__main__":